@@ -4,7 +4,7 @@ from __future__ import annotations
 main_storyhud.py
 
 Architecture Overview:
-This script implements a stateless AI agent for controlling Windows via visual feedback, where the 'story-memory' overlay on screenshots serves as the sole persistent memory, embodying the agent's 'self-awareness'—ironically, the story is the AI! The system captures screenshots with overlays, processes them through a Vision-Language Model (VLM) to decide actions and update the story, executes inputs (mouse/keyboard), and waits for UI stability. It's designed for tasks like opening apps and drawing in Paint, relying on atemporal, causal descriptions in the story to maintain context across stateless API calls. No external dependencies beyond standard libraries; all Win32 interactions are via ctypes, and PNG encoding is custom-implemented.
+This script implements a stateless AI agent for controlling Windows via visual feedback, where the 'story-memory' overlay on screenshots serves as the sole persistent memory, embodying the agent's 'self-awareness'—ironically, the story is the AI! The system captures screenshots with overlays, processes them through a Vision-Language Model (VLM) to decide actions and update the story, executes inputs (mouse/keyboard), and waits for UI stability. It's designed for tasks like opening apps and drawing in Paint, relying on atemporal, causal descriptions in the story to maintain context across stateless API calls. NumPy is the only required external dependency (used for pixel work; Numba, pybase64, Pillow and orjson are picked up when installed); all Win32 interactions are via ctypes, and PNG encoding is custom-implemented.
 
 Goal:
 - Overlay text is the *only memory*, visible in screenshots (stateless API).
@@ -15,27 +15,62 @@ Goal:
 This file is derived from the project's original main.py, with HUD + timing upgrades.
 """
 
-import base64
 import ctypes
 import ctypes.wintypes as w
+import hashlib
+import http.client
+import io
+import itertools
 import json
+import queue
 import re
 import struct
+import threading
 import time
-import urllib.request
-import urllib.error
+import urllib.parse
+import uuid
 import zlib
-from dataclasses import dataclass
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from enum import IntFlag
 from functools import cache
 from pathlib import Path
 from typing import Any, Literal
 
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # optional; the NumPy paths are used instead
+    njit = None
+
+try:
+    from pybase64 import b64encode  # SIMD encoder, same API
+except ImportError:  # optional
+    from base64 import b64encode
+
+try:
+    from PIL import Image
+except ImportError:  # optional; the VLM is sent PNG instead of JPEG
+    Image = None
+
+try:
+    import orjson
+except ImportError:  # optional; stdlib json is used instead
+    orjson = None
+
 # =========================
 # MODEL / API CONFIG
 # =========================
 MODEL_NAME = "qwen3-vl-2b-instruct"
 API_URL = "http://localhost:1234/v1/chat/completions"
+API_TIMEOUT_S = 30
+
+# Completion budgets: the default fits a full 16-line memory; the large one is for analysis steps
+# and for retrying after a response that did not parse (likely truncated).
+VLM_MAX_TOKENS = 480
+VLM_MAX_TOKENS_ANALYZE = 800
 
 # =========================
 # SCREENSHOT CONFIG
@@ -43,6 +78,17 @@ API_URL = "http://localhost:1234/v1/chat/completions"
 SCREENSHOT_QUALITY = 1
 SCREEN_W, SCREEN_H = {1: (1536, 864), 2: (1024, 576), 3: (512, 288)}[SCREENSHOT_QUALITY]
 
+# Image sent to the VLM: "jpeg" (needs Pillow, otherwise PNG is sent) or "png".
+VLM_IMAGE_FORMAT = "jpeg"
+VLM_JPEG_QUALITY = 85
+
+# "dxgi" = Desktop Duplication (falls back to GDI per frame when unavailable), "gdi" = BitBlt only.
+CAPTURE_BACKEND = "dxgi"
+DXGI_ACQUIRE_TIMEOUT_MS = 0  # 0 = take whatever frame is ready, reuse the last one otherwise
+
+# Responses reused for byte-identical frames (the overlay memory is part of the frame).
+FRAME_CACHE_SIZE = 64
+
 # =========================
 # INPUT / TIMING CONFIG
 # =========================
@@ -65,6 +111,8 @@ SETTLE_SAMPLE_W, SETTLE_SAMPLE_H = 256, 144
 SETTLE_CHECK_INTERVAL_S = 0.10
 SETTLE_REQUIRED_STABLE = 2
 SETTLE_CHANGE_RATIO_THRESHOLD = 0.006  # ~0.6% sampled pixels
+SETTLE_DIFF_CHUNK = 4096  # pixels compared per early-exit check
+SETTLE_QUANT_MASK = 0x00F0F0F0  # compare top 4 bits of B,G,R only: ignores alpha and antialiasing shimmer
 
 # =========================
 # HUD / OVERLAY CONFIG
@@ -140,6 +188,8 @@ class MouseEvent(IntFlag):
     WHEEL = 0x0800
     HWHEEL = 0x1000
 
+VK_RETURN = 0x0D
+
 class KeyEvent(IntFlag):
     KEYUP = 0x0002
     UNICODE = 0x0004
@@ -169,13 +219,32 @@ CURSOR_SHOWING = 0x00000001
 TRANSPARENT = 1
 DT_LEFT = 0x00000000
 DT_NOPREFIX = 0x00000800
+PS_SOLID = 0
 DI_NORMAL = 0x0003
+EVENT_SYSTEM_FOREGROUND = 0x0003
+EVENT_OBJECT_LOCATIONCHANGE = 0x800B
+WINEVENT_OUTOFCONTEXT = 0x0000
+WINEVENT_SKIPOWNPROCESS = 0x0002
+OBJID_WINDOW = 0
+CHILDID_SELF = 0
+GA_ROOT = 2
+QS_ALLINPUT = 0x04FF
+PM_REMOVE = 0x0001
+D3D_DRIVER_TYPE_HARDWARE = 1
+D3D11_SDK_VERSION = 7
+D3D11_USAGE_STAGING = 3
+D3D11_CPU_ACCESS_READ = 0x20000
+D3D11_MAP_READ = 1
+DXGI_FORMAT_B8G8R8A8_UNORM = 87
+DXGI_ERROR_ACCESS_LOST = 0x887A0026
+DXGI_ERROR_WAIT_TIMEOUT = 0x887A0027
 
 LRESULT = ctypes.c_ssize_t
 WPARAM = ctypes.c_size_t
 LPARAM = ctypes.c_ssize_t
 WNDPROC = ctypes.WINFUNCTYPE(LRESULT, w.HWND, w.UINT, WPARAM, LPARAM)
 ULONG_PTR = ctypes.c_size_t
+WINEVENTPROC = ctypes.WINFUNCTYPE(None, w.HANDLE, w.DWORD, w.HWND, w.LONG, w.LONG, w.DWORD, w.DWORD)
 
 class MOUSEINPUT(ctypes.Structure):
     _fields_ = [
@@ -237,6 +306,52 @@ class WNDCLASS(ctypes.Structure):
         ("lpszClassName", w.LPCWSTR),
     ]
 
+class GUID(ctypes.Structure):
+    _fields_ = [("Data1", w.DWORD), ("Data2", w.WORD), ("Data3", w.WORD), ("Data4", ctypes.c_ubyte * 8)]
+
+def _guid(s: str) -> GUID:
+    return GUID.from_buffer_copy(uuid.UUID(s).bytes_le)
+
+IID_IDXGIDevice = _guid("54ec77fa-1377-44e6-8c32-88fd5f44c84c")
+IID_IDXGIOutput1 = _guid("00cddea8-939b-4b83-a340-a685226666cc")
+IID_ID3D11Texture2D = _guid("6f15aaf2-d208-4e89-9ab4-489535d34f9c")
+
+class DXGI_OUTDUPL_POINTER_POSITION(ctypes.Structure):
+    _fields_ = [("Position", w.POINT), ("Visible", w.BOOL)]
+
+class DXGI_OUTDUPL_FRAME_INFO(ctypes.Structure):
+    _fields_ = [
+        ("LastPresentTime", ctypes.c_longlong), ("LastMouseUpdateTime", ctypes.c_longlong),
+        ("AccumulatedFrames", w.UINT), ("RectsCoalesced", w.BOOL),
+        ("ProtectedContentMaskedOut", w.BOOL), ("PointerPosition", DXGI_OUTDUPL_POINTER_POSITION),
+        ("TotalMetadataBufferSize", w.UINT), ("PointerShapeBufferSize", w.UINT),
+    ]
+
+class DXGI_RATIONAL(ctypes.Structure):
+    _fields_ = [("Numerator", w.UINT), ("Denominator", w.UINT)]
+
+class DXGI_MODE_DESC(ctypes.Structure):
+    _fields_ = [
+        ("Width", w.UINT), ("Height", w.UINT), ("RefreshRate", DXGI_RATIONAL),
+        ("Format", w.UINT), ("ScanlineOrdering", w.UINT), ("Scaling", w.UINT),
+    ]
+
+class DXGI_OUTDUPL_DESC(ctypes.Structure):
+    _fields_ = [("ModeDesc", DXGI_MODE_DESC), ("Rotation", w.UINT), ("DesktopImageInSystemMemory", w.BOOL)]
+
+class DXGI_SAMPLE_DESC(ctypes.Structure):
+    _fields_ = [("Count", w.UINT), ("Quality", w.UINT)]
+
+class D3D11_TEXTURE2D_DESC(ctypes.Structure):
+    _fields_ = [
+        ("Width", w.UINT), ("Height", w.UINT), ("MipLevels", w.UINT), ("ArraySize", w.UINT),
+        ("Format", w.UINT), ("SampleDesc", DXGI_SAMPLE_DESC), ("Usage", w.UINT),
+        ("BindFlags", w.UINT), ("CPUAccessFlags", w.UINT), ("MiscFlags", w.UINT),
+    ]
+
+class D3D11_MAPPED_SUBRESOURCE(ctypes.Structure):
+    _fields_ = [("pData", ctypes.c_void_p), ("RowPitch", w.UINT), ("DepthPitch", w.UINT)]
+
 user32.DefWindowProcW.argtypes = [w.HWND, w.UINT, WPARAM, LPARAM]
 user32.DefWindowProcW.restype = LRESULT
 
@@ -273,6 +388,14 @@ gdi32.SetBkMode.restype = ctypes.c_int
 gdi32.SetTextColor.argtypes = [w.HDC, w.DWORD]
 gdi32.SetTextColor.restype = w.DWORD
 gdi32.CreateFontW.restype = w.HFONT
+gdi32.CreatePen.argtypes = [ctypes.c_int, ctypes.c_int, w.DWORD]
+gdi32.CreatePen.restype = w.HPEN
+gdi32.BeginPath.argtypes = [w.HDC]
+gdi32.BeginPath.restype = w.BOOL
+gdi32.EndPath.argtypes = [w.HDC]
+gdi32.EndPath.restype = w.BOOL
+gdi32.StrokePath.argtypes = [w.HDC]
+gdi32.StrokePath.restype = w.BOOL
 
 user32.ReleaseDC.argtypes = [w.HWND, w.HDC]
 user32.ReleaseDC.restype = ctypes.c_int
@@ -297,6 +420,22 @@ user32.SetWindowPos.argtypes = [
 ]
 user32.SetWindowPos.restype = w.BOOL
 
+user32.SetWinEventHook.argtypes = [w.DWORD, w.DWORD, w.HMODULE, WINEVENTPROC, w.DWORD, w.DWORD, w.DWORD]
+user32.SetWinEventHook.restype = w.HANDLE
+user32.UnhookWinEvent.argtypes = [w.HANDLE]
+user32.UnhookWinEvent.restype = w.BOOL
+user32.GetAncestor.argtypes = [w.HWND, w.UINT]
+user32.GetAncestor.restype = w.HWND
+user32.IsWindowVisible.argtypes = [w.HWND]
+user32.IsWindowVisible.restype = w.BOOL
+user32.MsgWaitForMultipleObjects.argtypes = [w.DWORD, ctypes.POINTER(w.HANDLE), w.BOOL, w.DWORD, w.DWORD]
+user32.MsgWaitForMultipleObjects.restype = w.DWORD
+user32.PeekMessageW.argtypes = [ctypes.POINTER(w.MSG), w.HWND, w.UINT, w.UINT, w.UINT]
+user32.PeekMessageW.restype = w.BOOL
+user32.TranslateMessage.argtypes = [ctypes.POINTER(w.MSG)]
+user32.DispatchMessageW.argtypes = [ctypes.POINTER(w.MSG)]
+user32.DispatchMessageW.restype = LRESULT
+
 # =========================
 # INPUT HELPERS
 # =========================
@@ -309,48 +448,61 @@ class CoordConverter:
     sh: int
     mw: int
     mh: int
+    # Per-axis divisors for the 0..65535 mapping, fixed at construction (0 collapses a degenerate axis to 0).
+    _xden: int = field(init=False, repr=False, compare=False, default=0)
+    _yden: int = field(init=False, repr=False, compare=False, default=0)
+
+    def __post_init__(self) -> None:
+        if self.sw > 0 and self.sh > 0:
+            self._xden = self.sw - 1 if self.sw > 1 else 0
+            self._yden = self.sh - 1 if self.sh > 1 else 0
 
     def norm_to_screen(self, xn: float, yn: float) -> tuple[int, int]:
         return int(xn * self.sw / 1000), int(yn * self.sh / 1000)
 
     def to_win32_normalized(self, x: int, y: int) -> tuple[int, int]:
-        if self.sw <= 0 or self.sh <= 0:
-            return 0, 0
+        # Multiply before dividing, so the last pixel column/row lands exactly on 65535.
         return (
-            max(0, min(65535, int(x * 65535 / (self.sw - 1)))) if self.sw > 1 else 0,
-            max(0, min(65535, int(y * 65535 / (self.sh - 1)))) if self.sh > 1 else 0,
+            max(0, min(65535, int(x * 65535 / self._xden))) if self._xden else 0,
+            max(0, min(65535, int(y * 65535 / self._yden))) if self._yden else 0,
         )
 
-def _send_input(inputs: list[INPUT], *, delay_s: float = INPUT_DELAY_S) -> None:
-    arr = (INPUT * len(inputs))(*inputs)
-    if _SendInput(len(inputs), arr, ctypes.sizeof(INPUT)) != len(inputs):
+def _send_input(arr: ctypes.Array[INPUT], n: int | None = None, *, delay_s: float = INPUT_DELAY_S) -> None:
+    n = len(arr) if n is None else n
+    if _SendInput(n, arr, ctypes.sizeof(INPUT)) != n:
         raise ctypes.WinError(ctypes.get_last_error())
     if delay_s > 0:
         time.sleep(delay_s)
 
+def _set_mouse_input(inp: INPUT, dx: int, dy: int, data: int, flags: int) -> None:
+    inp.type = INPUT_MOUSE
+    inp.mi.dx = dx
+    inp.mi.dy = dy
+    inp.mi.mouseData = data
+    inp.mi.dwFlags = flags
+
 def mouse_move(x: int, y: int, conv: CoordConverter) -> None:
     ax, ay = conv.to_win32_normalized(x, y)
-    i = INPUT(type=INPUT_MOUSE)
-    i.mi = MOUSEINPUT(ax, ay, 0, MouseEvent.MOVE | MouseEvent.ABSOLUTE, 0, 0)
-    _send_input([i])
+    arr = (INPUT * 1)()
+    _set_mouse_input(arr[0], ax, ay, 0, int(MouseEvent.MOVE | MouseEvent.ABSOLUTE))
+    _send_input(arr)
 
 def mouse_click(x: int, y: int, conv: CoordConverter) -> None:
     ax, ay = conv.to_win32_normalized(x, y)
-    inputs = []
-    for flag in (MouseEvent.MOVE, MouseEvent.LEFT_DOWN, MouseEvent.LEFT_UP):
-        i = INPUT(type=INPUT_MOUSE)
-        i.mi = MOUSEINPUT(ax, ay, 0, int(flag) | int(MouseEvent.ABSOLUTE), 0, 0)
-        inputs.append(i)
-    _send_input(inputs)
+    arr = (INPUT * 3)()
+    for inp, flag in zip(arr, (MouseEvent.MOVE, MouseEvent.LEFT_DOWN, MouseEvent.LEFT_UP)):
+        _set_mouse_input(inp, ax, ay, 0, int(flag) | int(MouseEvent.ABSOLUTE))
+    _send_input(arr)
 
 def mouse_drag(x1: int, y1: int, x2: int, y2: int, conv: CoordConverter) -> None:
     ax1, ay1 = conv.to_win32_normalized(x1, y1)
     ax2, ay2 = conv.to_win32_normalized(x2, y2)
+    arr = (INPUT * 1)()
 
     def send(flags: int, dx: int, dy: int, *, delay: float = INPUT_DELAY_S) -> None:
-        inp = INPUT(type=INPUT_MOUSE)
-        inp.mi = MOUSEINPUT(dx, dy, 0, flags, 0, 0)
-        _send_input([inp], delay_s=delay)
+        # SendInput copies the events, so the single-slot array is reused for every step.
+        _set_mouse_input(arr[0], dx, dy, 0, flags)
+        _send_input(arr, delay_s=delay)
 
     send(int(MouseEvent.MOVE | MouseEvent.ABSOLUTE), ax1, ay1)
     send(int(MouseEvent.LEFT_DOWN | MouseEvent.ABSOLUTE), ax1, ay1)
@@ -367,180 +519,516 @@ def mouse_drag(x1: int, y1: int, x2: int, y2: int, conv: CoordConverter) -> None
 def type_text(text: str) -> None:
     if not text:
         return
-    inputs = []
-    for ch in text:
-        b = ch.encode("utf-16le")
-        for i in range(0, len(b), 2):
-            cu = b[i] | (b[i + 1] << 8)
-            for flags in (KeyEvent.UNICODE, KeyEvent.UNICODE | KeyEvent.KEYUP):
-                inp = INPUT(type=INPUT_KEYBOARD)
-                inp.ki = KEYBDINPUT(0, cu, int(flags), 0, 0)
-                inputs.append(inp)
-    _send_input(inputs)
+    buf = text.replace("\r\n", "\n").encode("utf-16le")
+    units = struct.unpack(f"<{len(buf) // 2}H", buf)
+    down = int(KeyEvent.UNICODE)
+    up = int(KeyEvent.UNICODE | KeyEvent.KEYUP)
+    key_up = int(KeyEvent.KEYUP)
+    # One down/up pair per UTF-16 code unit, written straight into a preallocated array.
+    # Newlines become real Enter presses so "text\n" types and submits in a single step.
+    arr = (INPUT * (2 * len(units)))()
+    for i, cu in enumerate(units):
+        for inp, flags in ((arr[2 * i], down), (arr[2 * i + 1], up)):
+            inp.type = INPUT_KEYBOARD
+            if cu == 0x0A or cu == 0x0D:
+                inp.ki.wVk = VK_RETURN
+                inp.ki.dwFlags = flags & key_up
+            else:
+                inp.ki.wScan = cu
+                inp.ki.dwFlags = flags
+    _send_input(arr)
 
 def scroll(dx: float = 0.0, dy: float = 0.0) -> None:
-    inputs = []
+    wheels = []
     for delta, flag in ((dy, MouseEvent.WHEEL), (dx, MouseEvent.HWHEEL)):
         if delta:
             ticks = max(1, abs(int(delta)) // 100)
             direction = 1 if delta > 0 else -1
-            for _ in range(ticks):
-                inp = INPUT(type=INPUT_MOUSE)
-                inp.mi = MOUSEINPUT(0, 0, WHEEL_DELTA * direction, int(flag), 0, 0)
-                inputs.append(inp)
-    if inputs:
-        _send_input(inputs)
+            wheels += [(WHEEL_DELTA * direction, int(flag))] * ticks
+    if not wheels:
+        return
+    arr = (INPUT * len(wheels))()
+    for inp, (data, flags) in zip(arr, wheels):
+        _set_mouse_input(inp, 0, 0, data, flags)
+    _send_input(arr)
 
 # =========================
 # SCREEN CAPTURE + PNG ENCODE
 # =========================
-def _capture_desktop_bgra(sw: int, sh: int, *, include_cursor: bool = True) -> bytes:
-    sdc = user32.GetDC(0)
-    if not sdc:
-        raise ctypes.WinError(ctypes.get_last_error())
+class CaptureSession:
+    """Screen DC, memory DC and DIB section kept alive across captures of a fixed-size desktop."""
 
-    mdc = gdi32.CreateCompatibleDC(sdc)
-    if not mdc:
-        user32.ReleaseDC(0, sdc)
-        raise ctypes.WinError(ctypes.get_last_error())
+    def __init__(self, sw: int, sh: int):
+        self.sw = sw
+        self.sh = sh
 
-    bmi = BITMAPINFO()
-    bmi.bmiHeader.biSize = ctypes.sizeof(BITMAPINFOHEADER)
-    bmi.bmiHeader.biWidth = sw
-    bmi.bmiHeader.biHeight = -sh
-    bmi.bmiHeader.biPlanes = 1
-    bmi.bmiHeader.biBitCount = 32
-
-    bits = ctypes.c_void_p()
-    hbm = gdi32.CreateDIBSection(sdc, ctypes.byref(bmi), 0, ctypes.byref(bits), None, 0)
-    if not hbm:
-        gdi32.DeleteDC(mdc)
-        user32.ReleaseDC(0, sdc)
-        raise ctypes.WinError(ctypes.get_last_error())
+        self.sdc = None
+        self.mdc = None
+        self.hbm = None
+        self.bits = None
+        self.frame = None
+        # Backend-reported time of the last desktop update; None when the backend cannot tell.
+        self.last_present_time: int | None = None
 
-    gdi32.SelectObject(mdc, hbm)
-    if not gdi32.BitBlt(mdc, 0, 0, sw, sh, sdc, 0, 0, SRCCOPY):
-        gdi32.DeleteObject(hbm)
-        gdi32.DeleteDC(mdc)
-        user32.ReleaseDC(0, sdc)
-        raise ctypes.WinError(ctypes.get_last_error())
+    def __enter__(self) -> "CaptureSession":
+        self.sdc = user32.GetDC(0)
+        if not self.sdc:
+            raise ctypes.WinError(ctypes.get_last_error())
+
+        self.mdc = gdi32.CreateCompatibleDC(self.sdc)
+        if not self.mdc:
+            self.__exit__()
+            raise ctypes.WinError(ctypes.get_last_error())
+
+        bmi = BITMAPINFO()
+        bmi.bmiHeader.biSize = ctypes.sizeof(BITMAPINFOHEADER)
+        bmi.bmiHeader.biWidth = self.sw
+        bmi.bmiHeader.biHeight = -self.sh
+        bmi.bmiHeader.biPlanes = 1
+        bmi.bmiHeader.biBitCount = 32
+
+        self.bits = ctypes.c_void_p()
+        self.hbm = gdi32.CreateDIBSection(self.sdc, ctypes.byref(bmi), 0, ctypes.byref(self.bits), None, 0)
+        if not self.hbm:
+            self.__exit__()
+            raise ctypes.WinError(ctypes.get_last_error())
+
+        gdi32.SelectObject(self.mdc, self.hbm)
+        # Zero-copy (sh, sw, 4) view over the DIB pixels; overwritten by every capture().
+        buf = (ctypes.c_ubyte * (self.sw * self.sh * 4)).from_address(self.bits.value)
+        self.frame = np.frombuffer(buf, np.uint8).reshape(self.sh, self.sw, 4)
+        return self
 
-    if include_cursor:
-        ci = CURSORINFO(cbSize=ctypes.sizeof(CURSORINFO))
-        if user32.GetCursorInfo(ctypes.byref(ci)) and ci.flags & CURSOR_SHOWING:
-            ii = ICONINFO()
-            if user32.GetIconInfo(ci.hCursor, ctypes.byref(ii)):
-                x = ci.ptScreenPos.x - ii.xHotspot
-                y = ci.ptScreenPos.y - ii.yHotspot
-                user32.DrawIconEx(mdc, x, y, ci.hCursor, 0, 0, 0, 0, DI_NORMAL)
-                if ii.hbmMask:
-                    gdi32.DeleteObject(ii.hbmMask)
-                if ii.hbmColor:
-                    gdi32.DeleteObject(ii.hbmColor)
-
-    out = ctypes.string_at(bits, sw * sh * 4)
-    user32.ReleaseDC(0, sdc)
-    gdi32.DeleteDC(mdc)
-    gdi32.DeleteObject(hbm)
+    def __exit__(self, *args: Any) -> None:
+        self.frame = None
+        if self.mdc:
+            gdi32.DeleteDC(self.mdc)
+            self.mdc = None
+        if self.hbm:
+            gdi32.DeleteObject(self.hbm)
+            self.hbm = None
+        if self.sdc:
+            user32.ReleaseDC(0, self.sdc)
+            self.sdc = None
+
+    def _grab(self) -> None:
+        if not gdi32.BitBlt(self.mdc, 0, 0, self.sw, self.sh, self.sdc, 0, 0, SRCCOPY):
+            raise ctypes.WinError(ctypes.get_last_error())
+
+    def capture(self, *, include_cursor: bool = True) -> np.ndarray:
+        self._grab()
+
+        if include_cursor:
+            ci = CURSORINFO(cbSize=ctypes.sizeof(CURSORINFO))
+            if user32.GetCursorInfo(ctypes.byref(ci)) and ci.flags & CURSOR_SHOWING:
+                ii = ICONINFO()
+                if user32.GetIconInfo(ci.hCursor, ctypes.byref(ii)):
+                    x = ci.ptScreenPos.x - ii.xHotspot
+                    y = ci.ptScreenPos.y - ii.yHotspot
+                    user32.DrawIconEx(self.mdc, x, y, ci.hCursor, 0, 0, 0, 0, DI_NORMAL)
+                    if ii.hbmMask:
+                        gdi32.DeleteObject(ii.hbmMask)
+                    if ii.hbmColor:
+                        gdi32.DeleteObject(ii.hbmColor)
+
+        # GDI batches drawing calls; make sure the DIB is written before NumPy reads it.
+        gdi32.GdiFlush()
+        return self.frame
+
+def _com_method(obj: ctypes.c_void_p, index: int, *argtypes: Any, restype: Any = ctypes.c_long) -> Any:
+    vtbl = ctypes.cast(obj, ctypes.POINTER(ctypes.POINTER(ctypes.c_void_p))).contents
+    fn = ctypes.WINFUNCTYPE(restype, ctypes.c_void_p, *argtypes)(vtbl[index])
+    return lambda *args: fn(obj, *args)
+
+def _check_hr(hr: int) -> None:
+    if hr < 0:
+        raise ctypes.WinError(hr & 0xFFFFFFFF)
+
+def _com_query(obj: ctypes.c_void_p, iid: GUID) -> ctypes.c_void_p:
+    out = ctypes.c_void_p()
+    _check_hr(_com_method(obj, 0, ctypes.POINTER(GUID), ctypes.POINTER(ctypes.c_void_p))(ctypes.byref(iid), ctypes.byref(out)))
     return out
 
-def _downsample_nn_bgra(bgra: bytes, sw: int, sh: int, dw: int, dh: int) -> bytes:
+def _com_release(obj: ctypes.c_void_p) -> None:
+    _com_method(obj, 2, restype=w.ULONG)()
+
+class DXGICaptureSession(CaptureSession):
+    """CaptureSession fed by DXGI Desktop Duplication; the GDI DIB stays as the surface the cursor is drawn on."""
+
+    def __init__(self, sw: int, sh: int):
+        super().__init__(sw, sh)
+        self.device = None
+        self.context = None
+        self.dupl = None
+        self.staging = None
+        self._have_frame = False
+
+    def __enter__(self) -> "DXGICaptureSession":
+        super().__enter__()
+        try:
+            self._open_duplication()
+        except OSError:
+            self._close_duplication()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self._close_duplication()
+        super().__exit__(*args)
+
+    def _open_duplication(self) -> None:
+        self.device = ctypes.c_void_p()
+        self.context = ctypes.c_void_p()
+        level = w.UINT()
+        _check_hr(_dll("d3d11").D3D11CreateDevice(
+            None, D3D_DRIVER_TYPE_HARDWARE, None, 0, None, 0, D3D11_SDK_VERSION,
+            ctypes.byref(self.device), ctypes.byref(level), ctypes.byref(self.context)
+        ))
+
+        # ID3D11Device -> IDXGIDevice::GetAdapter -> IDXGIAdapter::EnumOutputs(0) -> IDXGIOutput1
+        dxgi_device = _com_query(self.device, IID_IDXGIDevice)
+        try:
+            adapter = ctypes.c_void_p()
+            _check_hr(_com_method(dxgi_device, 7, ctypes.POINTER(ctypes.c_void_p))(ctypes.byref(adapter)))
+        finally:
+            _com_release(dxgi_device)
+        try:
+            output = ctypes.c_void_p()
+            _check_hr(_com_method(adapter, 7, w.UINT, ctypes.POINTER(ctypes.c_void_p))(0, ctypes.byref(output)))
+        finally:
+            _com_release(adapter)
+        try:
+            output1 = _com_query(output, IID_IDXGIOutput1)
+        finally:
+            _com_release(output)
+        try:
+            self.dupl = ctypes.c_void_p()
+            _check_hr(_com_method(output1, 22, ctypes.c_void_p, ctypes.POINTER(ctypes.c_void_p))(self.device, ctypes.byref(self.dupl)))
+        finally:
+            _com_release(output1)
+
+        desc = DXGI_OUTDUPL_DESC()
+        _com_method(self.dupl, 7, ctypes.POINTER(DXGI_OUTDUPL_DESC), restype=None)(ctypes.byref(desc))
+        if (desc.ModeDesc.Width, desc.ModeDesc.Height) != (self.sw, self.sh) or desc.Rotation > 1:
+            raise OSError("Desktop duplication output does not match the capture size")
+
+        td = D3D11_TEXTURE2D_DESC(
+            self.sw, self.sh, 1, 1, DXGI_FORMAT_B8G8R8A8_UNORM, DXGI_SAMPLE_DESC(1, 0),
+            D3D11_USAGE_STAGING, 0, D3D11_CPU_ACCESS_READ, 0
+        )
+        self.staging = ctypes.c_void_p()
+        _check_hr(_com_method(self.device, 5, ctypes.POINTER(D3D11_TEXTURE2D_DESC), ctypes.c_void_p, ctypes.POINTER(ctypes.c_void_p))(
+            ctypes.byref(td), None, ctypes.byref(self.staging)
+        ))
+
+    def _close_duplication(self) -> None:
+        for name in ("staging", "dupl", "context", "device"):
+            obj = getattr(self, name)
+            if obj:
+                _com_release(obj)
+            setattr(self, name, None)
+        self._have_frame = False
+        self.last_present_time = None
+
+    def _grab(self) -> None:
+        if not self.dupl:
+            return super()._grab()
+
+        info = DXGI_OUTDUPL_FRAME_INFO()
+        resource = ctypes.c_void_p()
+        hr = _com_method(self.dupl, 8, w.UINT, ctypes.POINTER(DXGI_OUTDUPL_FRAME_INFO), ctypes.POINTER(ctypes.c_void_p))(
+            DXGI_ACQUIRE_TIMEOUT_MS, ctypes.byref(info), ctypes.byref(resource)
+        ) & 0xFFFFFFFF
+
+        if hr == DXGI_ERROR_ACCESS_LOST:
+            # Mode switch, secure desktop, etc.: rebuild the duplication and use GDI for this frame.
+            self._close_duplication()
+            try:
+                self._open_duplication()
+            except OSError:
+                self._close_duplication()
+            return super()._grab()
+
+        if hr != DXGI_ERROR_WAIT_TIMEOUT:
+            _check_hr(ctypes.c_long(hr).value)
+            try:
+                # LastPresentTime == 0 means only the pointer moved; the staging copy is still current.
+                if info.LastPresentTime:
+                    tex = _com_query(resource, IID_ID3D11Texture2D)
+                    try:
+                        _com_method(self.context, 47, ctypes.c_void_p, ctypes.c_void_p, restype=None)(self.staging, tex)
+                    finally:
+                        _com_release(tex)
+                    self.last_present_time = info.LastPresentTime
+                    self._have_frame = True
+            finally:
+                _com_release(resource)
+                _com_method(self.dupl, 14)()
+
+        if not self._have_frame:
+            return super()._grab()
+
+        # Re-copy from staging every time: the previous capture may have drawn the cursor into the DIB.
+        mapped = D3D11_MAPPED_SUBRESOURCE()
+        _check_hr(_com_method(self.context, 14, ctypes.c_void_p, w.UINT, w.UINT, w.UINT, ctypes.POINTER(D3D11_MAPPED_SUBRESOURCE))(
+            self.staging, 0, D3D11_MAP_READ, 0, ctypes.byref(mapped)
+        ))
+        try:
+            src = (ctypes.c_ubyte * (mapped.RowPitch * self.sh)).from_address(mapped.pData)
+            rows = np.frombuffer(src, np.uint8).reshape(self.sh, mapped.RowPitch)
+            self.frame.reshape(self.sh, self.sw * 4)[:] = rows[:, :self.sw * 4]
+        finally:
+            _com_method(self.context, 15, ctypes.c_void_p, w.UINT, restype=None)(self.staging, 0)
+
+@cache
+def _nn_indices(sw: int, sh: int, dw: int, dh: int) -> tuple[np.ndarray, np.ndarray]:
+    ys = (np.arange(dh) * (sh / dh)).astype(np.intp)
+    xs = (np.arange(dw) * (sw / dw)).astype(np.intp)
+    return ys[:, None], xs[None, :]
+
+def _nn_gather_kernel(src: np.ndarray, ys: np.ndarray, xs: np.ndarray, out: np.ndarray) -> None:
+    for y in range(ys.shape[0]):
+        sy = ys[y]
+        for x in range(xs.shape[0]):
+            sx = xs[x]
+            for c in range(4):
+                out[y, x, c] = src[sy, sx, c]
+
+def _png_filter_kernel(src: np.ndarray, out: np.ndarray) -> None:
+    # BGRA -> filter byte 0 + RGB per row, in a single pass.
+    for y in range(src.shape[0]):
+        out[y, 0] = 0
+        for x in range(src.shape[1]):
+            o = 1 + x * 3
+            out[y, o] = src[y, x, 2]
+            out[y, o + 1] = src[y, x, 1]
+            out[y, o + 2] = src[y, x, 0]
+
+if njit is not None:
+    _nn_gather_kernel = njit(cache=True, boundscheck=False)(_nn_gather_kernel)
+    _png_filter_kernel = njit(cache=True, boundscheck=False)(_png_filter_kernel)
+
+def _downsample_nn_bgra(bgra: np.ndarray, sw: int, sh: int, dw: int, dh: int) -> np.ndarray:
+    # Always returns an owned array: the source may be a view of a reused capture DIB.
     if sw == dw and sh == dh:
-        return bgra
-    out = bytearray(dw * dh * 4)
-    rx = sw / dw
-    ry = sh / dh
-    for y in range(dh):
-        sy = int(y * ry) * sw * 4
-        dy = y * dw * 4
-        for x in range(dw):
-            sx = int(x * rx) * 4
-            out[dy:dy+4] = bgra[sy + sx:sy + sx + 4]
-            dy += 4
-    return bytes(out)
-
-def _encode_png_rgb(data: bytes, w: int, h: int) -> bytes:
-    # Convert BGRA to RGB (drop alpha)
-    rgb = bytearray(len(data) * 3 // 4)
-    j = 0
-    for i in range(0, len(data), 4):
-        rgb[j] = data[i + 2]  # R
-        rgb[j + 1] = data[i + 1]  # G
-        rgb[j + 2] = data[i]  # B
-        j += 3
-    rgb = bytes(rgb)
-
-    row_len = w * 3
-    # Apply filter (none) to each row and concatenate
-    filtered_data = b''
-    for i in range(0, len(rgb), row_len):
-        filtered_data += b'\x00' + rgb[i:i + row_len]
-
-    # Compress the entire filtered data
-    compressed = zlib.compress(filtered_data)
-
-    # IHDR: width, height, bit depth 8, color type 2 (RGB), compression 0, filter 0, interlace 0
+        return bgra.copy()
+    if sw % dw == 0 and sh % dh == 0:
+        # Integer ratio: nearest-neighbour is a plain strided slice (same pixels as the gather).
+        return np.ascontiguousarray(bgra[::sh // dh, ::sw // dw])
+    ys, xs = _nn_indices(sw, sh, dw, dh)
+    if njit is not None:
+        out = np.empty((dh, dw, 4), np.uint8)
+        _nn_gather_kernel(bgra, ys[:, 0], xs[0], out)
+        return out
+    return bgra[ys, xs]
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_PNG_CHUNK_HEAD = struct.Struct('>I4s')
+_PNG_CRC = struct.Struct('>I')
+_PNG_IDAT_CRC = zlib.crc32(b'IDAT')
+_PNG_IEND_CHUNK = _PNG_CHUNK_HEAD.pack(0, b'IEND') + _PNG_CRC.pack(zlib.crc32(b'IEND'))
+
+@cache
+def _png_header(w: int, h: int) -> bytes:
+    # Signature + IHDR: width, height, bit depth 8, color type 2 (RGB), compression 0, filter 0, interlace 0
     ihdr = struct.pack('>iiBBBBB', w, h, 8, 2, 0, 0, 0)
-    ihdr_chunk = struct.pack('>I', len(ihdr)) + b'IHDR' + ihdr + struct.pack('>I', zlib.crc32(b'IHDR' + ihdr))
+    return _PNG_SIGNATURE + _PNG_CHUNK_HEAD.pack(len(ihdr), b'IHDR') + ihdr + _PNG_CRC.pack(zlib.crc32(b'IHDR' + ihdr))
+
+def _encode_png_rgb(data: np.ndarray, w: int, h: int) -> bytearray:
+    # Convert BGRA to RGB (drop alpha) and prefix each row with filter type 0 (none)
+    arr = data.reshape(h, w, 4)
+    if njit is not None:
+        filtered = np.empty((h, 1 + w * 3), np.uint8)
+        _png_filter_kernel(arr, filtered)
+    else:
+        filtered = np.zeros((h, 1 + w * 3), np.uint8)
+        filtered[:, 1:] = arr[:, :, 2::-1].reshape(h, w * 3)
+
+    # Fast RLE-biased DEFLATE: desktop frames are mostly flat runs and are consumed immediately
+    co = zlib.compressobj(1, zlib.DEFLATED, 15, 8, zlib.Z_RLE)
+    parts = [co.compress(row) for row in filtered]
+    parts.append(co.flush())
+
+    # Assemble header + IDAT + IEND in one buffer; the IDAT CRC is accumulated part by part.
+    header = _png_header(w, h)
+    n = sum(map(len, parts))
+    out = bytearray(len(header) + _PNG_CHUNK_HEAD.size + n + _PNG_CRC.size + len(_PNG_IEND_CHUNK))
+    out[:len(header)] = header
+    pos = len(header)
+    _PNG_CHUNK_HEAD.pack_into(out, pos, n, b'IDAT')
+    pos += _PNG_CHUNK_HEAD.size
+    crc = _PNG_IDAT_CRC
+    for part in parts:
+        out[pos:pos + len(part)] = part
+        pos += len(part)
+        crc = zlib.crc32(part, crc)
+    _PNG_CRC.pack_into(out, pos, crc)
+    out[pos + _PNG_CRC.size:] = _PNG_IEND_CHUNK
+    return out
 
-    # IDAT chunk
-    idat_chunk = struct.pack('>I', len(compressed)) + b'IDAT' + compressed + struct.pack('>I', zlib.crc32(b'IDAT' + compressed))
+def _encode_jpeg_rgb(data: np.ndarray, w: int, h: int) -> bytes:
+    # Pillow's raw decoder reads BGRX directly, so no channel swap copy is needed.
+    im = Image.frombuffer("RGB", (w, h), data, "raw", "BGRX", 0, 1)
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", quality=VLM_JPEG_QUALITY, optimize=False)
+    return buf.getvalue()
 
-    # IEND chunk
-    iend_chunk = struct.pack('>I', 0) + b'IEND' + struct.pack('>I', zlib.crc32(b'IEND'))
+_VLM_JPEG = Image is not None and VLM_IMAGE_FORMAT == "jpeg"
+VLM_IMAGE_MIME = "image/jpeg" if _VLM_JPEG else "image/png"
 
-    # PNG signature
-    header = b'\x89PNG\r\n\x1a\n'
+# zlib and Pillow release the GIL, so encoding on these workers overlaps real work on the main thread.
+_encode_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="encode")
 
-    return header + ihdr_chunk + idat_chunk + iend_chunk
+def _encode_async(bgra: np.ndarray, *, dump: bool) -> tuple[Future[bytes], Future[bytearray] | None]:
+    """Start encoding one frame: (VLM payload, PNG for the debug dump or None when not dumping)."""
+    if not _VLM_JPEG:
+        png = _encode_pool.submit(_encode_png_rgb, bgra, SCREEN_W, SCREEN_H)
+        return png, png
+    payload = _encode_pool.submit(_encode_jpeg_rgb, bgra, SCREEN_W, SCREEN_H)
+    return payload, _encode_pool.submit(_encode_png_rgb, bgra, SCREEN_W, SCREEN_H) if dump else None
 
 # =========================
 # SCREEN STABILITY
 # =========================
-def wait_for_screen_settle(conv: CoordConverter) -> None:
+def _sample_pixels32(frame: np.ndarray, dw: int, dh: int) -> np.ndarray:
+    # Gather dw*dh whole BGRA pixels (as uint32) straight from the capture view; returns a flat array.
+    sh, sw = frame.shape[:2]
+    ys, xs = _nn_indices(sw, sh, dw, dh)
+    return frame.view(np.uint32)[ys, xs, 0].reshape(-1)
+
+def _frames_differ(prev: np.ndarray, curr: np.ndarray, threshold: float) -> bool:
+    # Compare whole BGRA pixels (uint32) chunk by chunk; bail out once the threshold is crossed.
+    limit = threshold * curr.size
+    changed = 0
+    for i in range(0, curr.size, SETTLE_DIFF_CHUNK):
+        changed += np.count_nonzero(prev[i:i + SETTLE_DIFF_CHUNK] != curr[i:i + SETTLE_DIFF_CHUNK])
+        if changed >= limit:
+            return True
+    return False
+
+def _wait_for_composition() -> None:
+    """Block until DWM has composed pending window updates (about one vsync); short sleep if DWM is unavailable."""
+    try:
+        if _dll("dwmapi").DwmFlush() >= 0:
+            return
+    except OSError:
+        pass
+    time.sleep(0.05)
+
+class WinEventWatcher:
+    """Out-of-context WinEvent hook that notes when visible top-level windows move or change focus."""
+
+    def __init__(self) -> None:
+        self._hooks: list[int] = []
+        self._proc = WINEVENTPROC(self._on_event)
+        self._dirty = False
+
+    def _on_event(self, hook: int, event: int, hwnd: int, id_object: int, id_child: int, thread: int, ms: int) -> None:
+        if event == EVENT_SYSTEM_FOREGROUND:
+            self._dirty = True
+        elif (id_object == OBJID_WINDOW and id_child == CHILDID_SELF and hwnd
+              and user32.GetAncestor(hwnd, GA_ROOT) == hwnd and user32.IsWindowVisible(hwnd)):
+            # Child controls moving inside a busy app say nothing about the window layout settling.
+            self._dirty = True
+
+    def __enter__(self) -> "WinEventWatcher":
+        self.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        flags = WINEVENT_OUTOFCONTEXT | WINEVENT_SKIPOWNPROCESS
+        for event in (EVENT_SYSTEM_FOREGROUND, EVENT_OBJECT_LOCATIONCHANGE):
+            hook = user32.SetWinEventHook(event, event, None, self._proc, 0, 0, flags)
+            if hook:
+                self._hooks.append(hook)
+
+    def stop(self) -> None:
+        for hook in self._hooks:
+            user32.UnhookWinEvent(hook)
+        self._hooks.clear()
+
+    def wait(self, timeout_s: float) -> bool:
+        """Pump messages (which delivers hook callbacks) for up to timeout_s.
+
+        Returns True as soon as a window moves, so the caller samples the new layout right away
+        instead of sleeping out the interval; False after a quiet timeout_s.
+        """
+        self._dirty = False
+        msg = w.MSG()
+        deadline = time.time() + timeout_s
+        while (remaining := deadline - time.time()) > 0:
+            user32.MsgWaitForMultipleObjects(0, None, False, int(remaining * 1000), QS_ALLINPUT)
+            while user32.PeekMessageW(ctypes.byref(msg), None, 0, 0, PM_REMOVE):
+                user32.TranslateMessage(ctypes.byref(msg))
+                user32.DispatchMessageW(ctypes.byref(msg))
+            if self._dirty:
+                return True
+        return False
+
+def wait_for_screen_settle(cap: CaptureSession, events: WinEventWatcher, *, full_capture: bool = True) -> np.ndarray | None:
+    """Block until the desktop stops changing (or SETTLE_MAX_S passes).
+
+    A window move reported by events ends the current check interval early and resets the count.
+
+    With full_capture, the last full-resolution frame (cursor included) is returned so the caller
+    can use it as the next screenshot; it is a view of the capture DIB, valid until the next capture.
+    """
     if not SETTLE_ENABLED:
-        return
+        return None
     start = time.time()
     stable_count = 0
     prev = None
+    prev_present = None
+    frame = None
     while time.time() - start < SETTLE_MAX_S:
-        time.sleep(SETTLE_CHECK_INTERVAL_S)
-        curr = _capture_desktop_bgra(conv.sw, conv.sh, include_cursor=False)
-        curr = _downsample_nn_bgra(curr, conv.sw, conv.sh, SETTLE_SAMPLE_W, SETTLE_SAMPLE_H)
+        moved = events.wait(SETTLE_CHECK_INTERVAL_S)
+        frame = cap.capture(include_cursor=full_capture)
+        curr = _sample_pixels32(frame, SETTLE_SAMPLE_W, SETTLE_SAMPLE_H)
+        curr &= SETTLE_QUANT_MASK
+        # Desktop Duplication reports when nothing was presented; no pixel diff needed then.
+        present = cap.last_present_time
+        unchanged = present is not None and present == prev_present
+        prev_present = present
         if prev is not None:
-            diff = sum(1 for a, b in zip(prev, curr) if a != b) / len(curr)
-            if diff < SETTLE_CHANGE_RATIO_THRESHOLD:
+            if not moved and (unchanged or not _frames_differ(prev, curr, SETTLE_CHANGE_RATIO_THRESHOLD)):
                 stable_count += 1
                 if stable_count >= SETTLE_REQUIRED_STABLE:
-                    return
+                    break
             else:
                 stable_count = 0
         prev = curr
+    return frame if full_capture else None
 
 # =========================
 # OVERLAY MANAGER
 # =========================
-def _fill_rect_bgra(bits: ctypes.c_void_p, w: int, h: int, rect: tuple[int, int, int, int], bgr: tuple[int, int, int], alpha: int) -> None:
+def _fill_rect_bgra(pixels: np.ndarray, rect: tuple[int, int, int, int], bgr: tuple[int, int, int], alpha: int) -> None:
+    h, w = pixels.shape[:2]
     x1, y1, x2, y2 = rect
     x1 = max(0, x1)
     y1 = max(0, y1)
     x2 = min(w, x2)
     y2 = min(h, y2)
-    data = ctypes.cast(bits, ctypes.POINTER(ctypes.c_ubyte))
-    for y in range(y1, y2):
-        row = y * w * 4
-        for x in range(x1, x2):
-            off = row + x * 4
-            data[off] = bgr[0]
-            data[off + 1] = bgr[1]
-            data[off + 2] = bgr[2]
-            data[off + 3] = alpha
+    if x1 < x2 and y1 < y2:
+        pixels[y1:y2, x1:x2] = (bgr[0], bgr[1], bgr[2], alpha)
+
+@cache
+def _get_font(size: int, weight: int, face: str) -> int:
+    # Process-lifetime GDI font handles, shared by every OverlayManager.
+    return gdi32.CreateFontW(size, 0, 0, 0, weight, 0, 0, 0, 0, 0, 0, 0, 0, face)
+
+@cache
+def _get_pen(width: int, color: int) -> int:
+    return gdi32.CreatePen(PS_SOLID, width, color)
 
 def _draw_text_outlined(hdc: w.HDC, text: str, rect: w.RECT, flags: int) -> None:
-    gdi32.SetTextColor(hdc, HUD_OUTLINE_COLOR)
-    for dx, dy in [(-HUD_OUTLINE_PX, 0), (HUD_OUTLINE_PX, 0), (0, -HUD_OUTLINE_PX), (0, HUD_OUTLINE_PX)]:
-        r = w.RECT(rect.left + dx, rect.top + dy, rect.right + dx, rect.bottom + dy)
-        user32.DrawTextW(hdc, text, -1, ctypes.byref(r), flags)
+    # Stroke the glyph outlines as a path with the selected outline pen, then draw the fill on top.
+    gdi32.BeginPath(hdc)
+    user32.DrawTextW(hdc, text, -1, ctypes.byref(rect), flags)
+    gdi32.EndPath(hdc)
+    gdi32.StrokePath(hdc)
     gdi32.SetTextColor(hdc, HUD_TEXT_COLOR)
     user32.DrawTextW(hdc, text, -1, ctypes.byref(rect), flags)
 
@@ -553,7 +1041,11 @@ class OverlayManager:
         self.hwnd = None
         self.hdc = None
         self.bits = None
+        self.pixels = None
         self._fonts = []
+        self._last_story: str | None = None
+        self._layout_cache: tuple[str, list[list[str]], int] | None = None
+        self._extent_cache: dict[tuple[int, str], int] = {}
 
     def __enter__(self) -> "OverlayManager":
         class_name = "OverlayWnd"
@@ -577,6 +1069,8 @@ class OverlayManager:
         hbm = gdi32.CreateDIBSection(None, ctypes.byref(bmi), 0, ctypes.byref(self.bits), None, 0)
         if not hbm:
             raise ctypes.WinError(ctypes.get_last_error())
+        buf = (ctypes.c_ubyte * (self.w * self.h * 4)).from_address(self.bits.value)
+        self.pixels = np.frombuffer(buf, np.uint8).reshape(self.h, self.w, 4)
 
         self.hdc = gdi32.CreateCompatibleDC(0)
         if not self.hdc:
@@ -585,11 +1079,11 @@ class OverlayManager:
 
         gdi32.SelectObject(self.hdc, hbm)
         gdi32.SetBkMode(self.hdc, TRANSPARENT)
+        # Pen width is doubled because StrokePath centres the stroke on the glyph edge.
+        gdi32.SelectObject(self.hdc, _get_pen(HUD_OUTLINE_PX * 2, HUD_OUTLINE_COLOR))
 
         font_sizes = [HUD_FONT_SIZE_PRIORITY, HUD_FONT_SIZE_DETAIL, HUD_FONT_SIZE_FADE]
-        for size in font_sizes:
-            font = gdi32.CreateFontW(size, 0, 0, 0, HUD_FONT_WEIGHT, 0, 0, 0, 0, 0, 0, 0, 0, "Segoe UI")
-            self._fonts.append(font)
+        self._fonts = [_get_font(size, HUD_FONT_WEIGHT, "Segoe UI") for size in font_sizes]
 
         user32.ShowWindow(self.hwnd, SW_SHOWNOACTIVATE)
         self.render()
@@ -600,8 +1094,6 @@ class OverlayManager:
             user32.DestroyWindow(self.hwnd)
         if self.hdc:
             gdi32.DeleteDC(self.hdc)
-        for font in self._fonts:
-            gdi32.DeleteObject(font)
 
     def reassert_topmost(self) -> None:
         for _ in range(OVERLAY_REASSERT_PULSES):
@@ -609,15 +1101,16 @@ class OverlayManager:
             time.sleep(OVERLAY_REASSERT_PAUSE_S)
 
     def set_story(self, story: str) -> None:
+        if story != self.story:
+            # Keep measurements only for lines that survive into the new story.
+            keep = {ln.strip() for ln in story.splitlines()}
+            self._extent_cache = {k: cx for k, cx in self._extent_cache.items() if k[1] in keep}
         self.story = story
 
-    def render(self) -> None:
-        # Clear bitmap to transparent
-        ctypes.memset(self.bits, 0, self.w * self.h * 4)
-
-        if not self.story:
-            self.reassert_topmost()
-            return
+    def _layout(self) -> tuple[list[list[str]], int]:
+        """Split the story into font tiers and measure the widest line (cached per story)."""
+        if self._layout_cache is not None and self._layout_cache[0] == self.story:
+            return self._layout_cache[1], self._layout_cache[2]
 
         lines = [ln.strip() for ln in self.story.splitlines() if ln.strip()]
         sections = [
@@ -626,16 +1119,41 @@ class OverlayManager:
             lines[HUD_LINES_PRIORITY + HUD_LINES_DETAIL:HUD_LINES_PRIORITY + HUD_LINES_DETAIL + HUD_LINES_FADE],
         ]
 
-        font_sizes = [HUD_FONT_SIZE_PRIORITY, HUD_FONT_SIZE_DETAIL, HUD_FONT_SIZE_FADE]
         max_width = 0
         for idx, lines in enumerate(sections):
             if not lines:
                 continue
-            gdi32.SelectObject(self.hdc, self._fonts[idx])
+            selected = False
             for line in lines:
-                sz = w.SIZE()
-                gdi32.GetTextExtentPoint32W(self.hdc, line, len(line), ctypes.byref(sz))
-                max_width = max(max_width, sz.cx)
+                cx = self._extent_cache.get((idx, line))
+                if cx is None:
+                    if not selected:
+                        gdi32.SelectObject(self.hdc, self._fonts[idx])
+                        selected = True
+                    sz = w.SIZE()
+                    gdi32.GetTextExtentPoint32W(self.hdc, line, len(line), ctypes.byref(sz))
+                    cx = self._extent_cache[(idx, line)] = sz.cx
+                max_width = max(max_width, cx)
+
+        self._layout_cache = (self.story, sections, max_width)
+        return sections, max_width
+
+    def render(self, *, force: bool = False) -> None:
+        # Same story as the last paint: the layered window already shows it.
+        if self.story == self._last_story and not force:
+            self.reassert_topmost()
+            return
+        self._last_story = self.story
+
+        # Clear bitmap to transparent
+        self.pixels.fill(0)
+
+        if not self.story:
+            self.reassert_topmost()
+            return
+
+        sections, max_width = self._layout()
+        font_sizes = [HUD_FONT_SIZE_PRIORITY, HUD_FONT_SIZE_DETAIL, HUD_FONT_SIZE_FADE]
 
         if HUD_BG_ENABLED and any(sections):
             est = 0
@@ -644,7 +1162,7 @@ class OverlayManager:
                     continue
                 est += len(lines) * (abs(font_sizes[idx]) + HUD_LINE_SPACING)
             bg_rect = (HUD_MARGIN - 6, HUD_MARGIN - 6, HUD_MARGIN + max_width + 12, HUD_MARGIN + est + 12)
-            _fill_rect_bgra(self.bits, self.w, self.h, bg_rect, HUD_BG_COLOR_BGR, HUD_BG_ALPHA)
+            _fill_rect_bgra(self.pixels, bg_rect, HUD_BG_COLOR_BGR, HUD_BG_ALPHA)
 
         x = HUD_MARGIN
         y = HUD_MARGIN
@@ -674,7 +1192,12 @@ class OverlayManager:
 # =========================
 # ACTION COMMAND
 # =========================
-@dataclass(slots=True)
+_ACTION_TOOLS = frozenset(("click", "move", "drag", "type", "scroll", "done", "analyze"))
+
+def _num(v: Any) -> float | None:
+    return float(v[0]) if isinstance(v, list) and v else float(v) if v is not None and v != "" else None
+
+@dataclass(slots=True, frozen=True)
 class ActionCommand:
     tool: ActionTool
     reasoning: str = ""
@@ -691,23 +1214,23 @@ class ActionCommand:
 
     @classmethod
     def from_dict(cls, d: dict[str, Any]) -> "ActionCommand":
-        num = lambda v: float(v[0]) if isinstance(v, list) and v else float(v) if v is not None and v != "" else None
-        tool = d.get("tool", "")
-        if tool not in {"click", "move", "drag", "type", "scroll", "done", "analyze"}:
+        get = d.get
+        tool = get("tool", "")
+        if tool not in _ACTION_TOOLS:
             tool = "done"
         return cls(
             tool=tool,
-            reasoning=str(d.get("reasoning", "") or "").strip(),
-            memory=d.get("memory", None),
-            x=num(d.get("x")),
-            y=num(d.get("y")),
-            text=str(d.get("text", "") or ""),
-            dx=num(d.get("dx")) or 0.0,
-            dy=num(d.get("dy")) or 0.0,
-            x1=num(d.get("x1")),
-            y1=num(d.get("y1")),
-            x2=num(d.get("x2")),
-            y2=num(d.get("y2")),
+            reasoning=str(get("reasoning", "") or "").strip(),
+            memory=get("memory", None),
+            x=_num(get("x")),
+            y=_num(get("y")),
+            text=str(get("text", "") or ""),
+            dx=_num(get("dx")) or 0.0,
+            dy=_num(get("dy")) or 0.0,
+            x1=_num(get("x1")),
+            y1=_num(get("y1")),
+            x2=_num(get("x2")),
+            y2=_num(get("y2")),
         )
 
     def validate(self) -> bool:
@@ -715,7 +1238,7 @@ class ActionCommand:
             case "click" | "move":
                 return self.x is not None and self.y is not None and 0 <= self.x <= 1000 and 0 <= self.y <= 1000
             case "drag":
-                return all(v is not None and 0 <= v <= 1000 for v in [self.x1, self.y1, self.x2, self.y2])
+                return all(v is not None and 0 <= v <= 1000 for v in (self.x1, self.y1, self.x2, self.y2))
             case "scroll":
                 return abs(self.dx) <= 10000 and abs(self.dy) <= 10000
             case "type":
@@ -837,7 +1360,7 @@ Example of analyze output:
 Only include fields relevant to the tool:
 - For "click" or "move": include "x" and "y".
 - For "drag": include "x1", "y1", "x2", "y2".
-- For "type": include "text".
+- For "type": include "text". End "text" with "\n" to press Enter after typing (e.g. "paint\n"), so typing and submitting take one step.
 - For "scroll": include "dx" and "dy".
 - For "analyze": include "reasoning" as string.
 - For "done": no extra fields needed.
@@ -846,31 +1369,76 @@ Coordinates are normalized: top-left 0,0. bottom-right 1000,1000.
 Return tool "done" only when the GOAL is complete in the visible world.
 """
 
-def call_vlm(png_data: bytes, goal: str | None = None) -> str:
-    text = "Continue story-memory from overlay. Output JSON."
-    if goal is not None:
-        text = f"GOAL: {goal}\n\n{text}"
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": [
-            {"type": "text", "text": text},
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64.b64encode(png_data).decode()}"}}
-        ]}
-    ]
-    payload = {
-        "model": MODEL_NAME,
-        "messages": messages,
+if orjson is not None:
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+else:
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+    _json_loads = json.loads
+
+_API = urllib.parse.urlsplit(API_URL)
+_api_conn: http.client.HTTPConnection | None = None
+
+def _post_json(body: bytes) -> bytes:
+    """POST body to API_URL over one persistent keep-alive connection; reconnects once if it went stale."""
+    global _api_conn
+    path = _API.path + (f"?{_API.query}" if _API.query else "")
+    retry = True
+    while True:
+        if _api_conn is None:
+            conn_cls = http.client.HTTPSConnection if _API.scheme == "https" else http.client.HTTPConnection
+            _api_conn = conn_cls(_API.hostname, _API.port, timeout=API_TIMEOUT_S)
+        try:
+            _api_conn.request("POST", path, body, {"Content-Type": "application/json", "Connection": "keep-alive"})
+            resp = _api_conn.getresponse()
+            data = resp.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # The server dropped an idle keep-alive connection; retry once on a fresh one.
+            _api_conn.close()
+            _api_conn = None
+            if not retry:
+                raise
+            retry = False
+            continue
+        except (OSError, http.client.HTTPException):
+            _api_conn.close()
+            _api_conn = None
+            raise
+        if resp.status >= 400:
+            raise http.client.HTTPException(f"HTTP Error {resp.status}: {resp.reason}")
+        return data
+
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+_USER_INSTRUCTION = {"type": "text", "text": "Continue story-memory from overlay. Output JSON."}
+
+# The request body up to the user's first content part never changes, so it is serialized once;
+# call_vlm splices the per-step parts after it as raw JSON bytes.
+_REQUEST_HEAD = b"".join((
+    b'{"model":', _json_dumps(MODEL_NAME),
+    b',"messages":[', _json_dumps(_SYSTEM_MESSAGE),
+    b',{"role":"user","content":[', _json_dumps(_USER_INSTRUCTION),
+))
+
+def call_vlm(image_data: bytes, goal: str | None = None, *, mime: str = "image/png", max_tokens: int = VLM_MAX_TOKENS_ANALYZE) -> str:
+    # Constant parts lead so every request shares the same token prefix (server-side prefix KV cache);
+    # the one-off GOAL follows them instead of being spliced in front of the instruction.
+    # Base64 and the MIME type are plain ASCII, so the image goes in without a JSON escaping pass.
+    sampling = {
         "temperature": 0.7,
-        "max_tokens": 800,
+        "max_tokens": max_tokens,
         "top_p": 0.8,
         "frequency_penalty": 1.1,
     }
-    req = urllib.request.Request(API_URL, json.dumps(payload).encode("utf-8"),
-                                 {"Content-Type": "application/json"})
+    body = b"".join((
+        _REQUEST_HEAD,
+        b"," + _json_dumps({"type": "text", "text": f"\n\nGOAL: {goal}"}) if goal is not None else b"",
+        b',{"type":"image_url","image_url":{"url":"data:', mime.encode("ascii"), b";base64,", b64encode(image_data),
+        b'"}}]}],', _json_dumps(sampling)[1:],
+    ))
     try:
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            data = json.load(resp)
-    except (urllib.error.URLError, urllib.error.HTTPError, TimeoutError) as e:
+        data = _json_loads(_post_json(body))
+    except (OSError, http.client.HTTPException) as e:
         raise RuntimeError(f"VLM API call failed: {e}") from e
     except json.JSONDecodeError as e:
         raise RuntimeError(f"VLM returned invalid JSON: {e}") from e
@@ -884,47 +1452,67 @@ def call_vlm(png_data: bytes, goal: str | None = None) -> str:
         raise ValueError("Invalid API response: missing message")
 
     content = message.get("content", "")
+    if isinstance(content, str):
+        return content
     return "".join(p.get("text", "") if isinstance(p, dict) else str(p)
                    for p in content) if isinstance(content, list) else str(content)
 
+_JSON_DECODER = json.JSONDecoder()
+
+def _strip_fences(s: str) -> str:
+    # Drop ```...``` blocks left to right; an unclosed final fence is kept as-is.
+    parts = s.split("```")
+    kept = parts[0::2]
+    if len(parts) % 2 == 0:
+        kept.append("```" + parts[-1])
+    return "".join(kept)
+
+def _decode_first_object(s: str) -> dict[str, Any] | None:
+    i = s.find("{")
+    if i < 0:
+        return None
+    try:
+        obj, _ = _JSON_DECODER.raw_decode(s, i)
+    except ValueError:
+        return None
+    return obj
+
 def parse_response(resp: str) -> dict[str, Any] | None:
     # Try to extract the first JSON object from the response (robust to stray text).
     if not resp:
         return None
     s = resp.strip()
 
-    # Remove fenced code blocks if present.
-    s = re.sub(r"```.*?```", "", s, flags=re.DOTALL).strip()
+    # Prefer JSON outside fenced code blocks; fall back to a fenced one if that is all there is.
+    return _decode_first_object(_strip_fences(s)) or _decode_first_object(s)
 
-    m = re.search(r"\{.*\}", s, flags=re.DOTALL)
-    if not m:
-        return None
-    js = m.group(0)
-    try:
-        return json.loads(js)
-    except Exception:
-        return None
-
-def capture_screenshot(conv: CoordConverter) -> bytes:
-    # small pause helps input settle; primary stabilization happens elsewhere
-    time.sleep(0.05)
-    desk = _capture_desktop_bgra(conv.sw, conv.sh, include_cursor=True)
+def capture_screenshot(cap: CaptureSession, conv: CoordConverter) -> np.ndarray:
+    # let the compositor present the overlay/input effects; primary stabilization happens elsewhere
+    _wait_for_composition()
+    desk = cap.capture(include_cursor=True)
     return _downsample_nn_bgra(desk, conv.sw, conv.sh, conv.mw, conv.mh)
 
-def _normalize_memory_field(mem: Any) -> str:
-    """Convert model 'memory' output into a displayable story string."""
+def _count_lines(text: str) -> int:
+    # Non-blank lines of the joined story; list items and sentences may span several lines.
+    return sum(1 for ln in text.splitlines() if ln.strip())
+
+def _normalize_memory_field(mem: Any) -> tuple[str, int]:
+    """Convert model 'memory' output into a displayable story string and its non-blank line count."""
     if mem is None:
-        return ""
+        return "", 0
     if isinstance(mem, list):
-        lines = [str(x).strip() for x in mem if str(x).strip()]
-        return "\n".join(lines)
-    return str(mem).strip()
+        text = "\n".join(t for t in (str(x).strip() for x in mem) if t)
+    else:
+        text = str(mem).strip()
+    return text, _count_lines(text)
+
+_SENT_RE = re.compile(r"(?<=[.!?])\s+")
 
 def _fallback_sentence_split(reasoning: str) -> list[str]:
     # Turn a paragraph into short lines. Not perfect, but better than 1-line overlay.
     if not reasoning:
         return []
-    parts = re.split(r"(?<=[.!?])\s+", reasoning.strip())
+    parts = _SENT_RE.split(reasoning.strip())
     lines = []
     for p in parts:
         p = p.strip()
@@ -937,92 +1525,128 @@ def _merge_story(old_story: str, new_story: str, *, max_lines: int = 16) -> str:
     """If model outputs too little, merge with old story (dedupe exact lines)."""
     if not new_story and old_story:
         return old_story
-    old_lines = [ln.rstrip() for ln in old_story.splitlines() if ln.strip()]
-    new_lines = [ln.rstrip() for ln in new_story.splitlines() if ln.strip()]
+    old_lines = filter(None, map(str.rstrip, old_story.splitlines()))
+    new_lines = filter(None, map(str.rstrip, new_story.splitlines()))
     # Prefer new lines first (freshness), then keep some of the old context.
-    merged = []
-    seen = set()
-    for ln in new_lines + old_lines:
-        if ln not in seen:
-            merged.append(ln)
-            seen.add(ln)
-        if len(merged) >= max_lines:
-            break
+    merged = list(dict.fromkeys(itertools.chain(new_lines, old_lines)))[:max_lines]
     return "\n".join(merged)
 
 # =========================
 # MAIN LOOP
 # =========================
+# Debug screenshots are written by a background thread so disk I/O never blocks a step.
+# None is the sentinel that stops the writer once everything queued before it is on disk.
+_dump_queue: queue.Queue[tuple[Path, Future[bytearray]] | None] = queue.Queue()
+
+def _dump_writer() -> None:
+    while (item := _dump_queue.get()) is not None:
+        path, png_future = item
+        try:
+            path.write_bytes(png_future.result())
+        except Exception as e:  # best-effort debug output; keep the writer alive
+            print(f"Failed to write debug screenshot {path}: {e}")
+
 def run_agent(goal: str, debug_dir: Path | None = None, initial_hud: str | None = None) -> None:
     sw, sh = get_screen_size()
     conv = CoordConverter(sw, sh, SCREEN_W, SCREEN_H)
 
-    with OverlayManager(sw, sh) as ov:
-        story = (initial_hud or "").strip()
-        if story:
-            ov.set_story(story)
-            ov.render()
-
-        ex = ActionExecutor(conv)
-        step = 0
-        failed_parses = 0
-        is_first = True
-
-        while True:
-            step += 1
-
-            # Capture screenshot (includes overlay memory).
-            bgra = capture_screenshot(conv)
-            png_data = _encode_png_rgb(bgra, SCREEN_W, SCREEN_H)
-
-            if debug_dir:
-                (debug_dir / f"step{step:03d}.png").write_bytes(png_data)
-
-            resp = call_vlm(png_data, goal if is_first else None)
-            is_first = False
-            d = parse_response(resp)
-
-            if not d:
-                failed_parses += 1
-                if failed_parses >= 3:
-                    raise RuntimeError("Failed to parse 3 consecutive responses")
-                continue
-
+    capture_cls = DXGICaptureSession if CAPTURE_BACKEND == "dxgi" else CaptureSession
+    writer = threading.Thread(target=_dump_writer, name="dump", daemon=True) if debug_dir else None
+    if writer is not None:
+        writer.start()
+    try:
+        with OverlayManager(sw, sh) as ov, capture_cls(sw, sh) as cap, WinEventWatcher() as events:
+            story = (initial_hud or "").strip()
+            if story:
+                ov.set_story(story)
+                ov.render()
+
+            ex = ActionExecutor(conv)
+            step = 0
             failed_parses = 0
-            cmd = ActionCommand.from_dict(d)
+            is_first = True
+            last_tool = ""
+            frame_cache: OrderedDict[bytes, dict[str, Any]] = OrderedDict()
 
-            if not cmd.validate():
-                continue
+            settled = None
+            while True:
+                step += 1
 
-            # Update overlay memory FIRST if provided (so it stays on-screen even if done).
-            new_story = _normalize_memory_field(cmd.memory)
-            if not new_story and cmd.reasoning:
-                # Back-compat for models that only fill "reasoning"
-                new_story = "\n".join(_fallback_sentence_split(cmd.reasoning))
-
-            # Enforce "not too short": if model returns < 6 lines, keep older story too.
-            if new_story:
-                line_count = len([ln for ln in new_story.splitlines() if ln.strip()])
-                if line_count < 6:
-                    story = _merge_story(story, new_story, max_lines=16)
+                # Capture screenshot (includes overlay memory), or reuse the frame the settle loop ended on
+                # (whose PNG encode is already running on the worker).
+                if settled is not None:
+                    bgra, (vlm_future, png_future) = settled
                 else:
-                    story = _merge_story("", new_story, max_lines=16)  # new story dominates
-            # If no new story, keep old.
-
-            ov.set_story(story)
-            ov.render()
-
-            if cmd.tool == "done":
-                break
-
-            delay = ex.execute(cmd)
-            time.sleep(delay)
+                    bgra = capture_screenshot(cap, conv)
+                    vlm_future, png_future = _encode_async(bgra, dump=debug_dir is not None)
+                settled = None
+                step_goal = goal if is_first else None
+                is_first = False
+                if debug_dir and png_future is not None:
+                    _dump_queue.put_nowait((debug_dir / f"step{step:03d}.png", png_future))
+
+                # A byte-identical frame gets the response it got before, once; a repeat asks the VLM again
+                # so an action that changes nothing cannot loop without the model seeing it.
+                # blake2b and zlib both release the GIL, so hashing runs in parallel with the encode.
+                key = hashlib.blake2b(bgra, digest_size=16).digest()
+                d = frame_cache.pop(key, None)
+                if d is None:
+                    max_tokens = VLM_MAX_TOKENS_ANALYZE if failed_parses or last_tool == "analyze" else VLM_MAX_TOKENS
+                    resp = call_vlm(vlm_future.result(), step_goal, mime=VLM_IMAGE_MIME, max_tokens=max_tokens)
+                    d = parse_response(resp)
+
+                    if not d:
+                        failed_parses += 1
+                        if failed_parses >= 3:
+                            raise RuntimeError("Failed to parse 3 consecutive responses")
+                        continue
+
+                    frame_cache[key] = d
+                    if len(frame_cache) > FRAME_CACHE_SIZE:
+                        frame_cache.popitem(last=False)
+
+                failed_parses = 0
+                cmd = ActionCommand.from_dict(d)
+                last_tool = cmd.tool
+
+                if not cmd.validate():
+                    continue
 
-            # Wait until UI settles (reduces half-rendered Start menu screenshots).
-            wait_for_screen_settle(conv)
+                # Update overlay memory FIRST if provided (so it stays on-screen even if done).
+                new_story, line_count = _normalize_memory_field(cmd.memory)
+                if not new_story and cmd.reasoning:
+                    # Back-compat for models that only fill "reasoning"
+                    new_story = "\n".join(_fallback_sentence_split(cmd.reasoning))
+                    line_count = _count_lines(new_story)
+
+                # Enforce "not too short": if model returns < 6 lines, keep older story too.
+                if new_story:
+                    if line_count < 6:
+                        story = _merge_story(story, new_story, max_lines=16)
+                    else:
+                        story = _merge_story("", new_story, max_lines=16)  # new story dominates
+                # If no new story, keep old.
+
+                ov.set_story(story)
+                ov.render()
+
+                if cmd.tool == "done":
+                    break
 
-            # Small pause so overlay definitely lands.
-            time.sleep(0.10)
+                delay = ex.execute(cmd)
+                time.sleep(delay)
+
+                # Wait until UI settles (reduces half-rendered Start menu screenshots).
+                # Without settling, capture_screenshot waits for composition on the next step.
+                frame = wait_for_screen_settle(cap, events)
+                if frame is not None:
+                    bgra = _downsample_nn_bgra(frame, conv.sw, conv.sh, conv.mw, conv.mh)
+                    settled = bgra, _encode_async(bgra, dump=debug_dir is not None)
+    finally:
+        # Ctrl+C and parse failures end runs too, and their last screenshots matter most for debugging.
+        if writer is not None:
+            _dump_queue.put(None)
+            writer.join()
 
 def main() -> None:
     print(f"Default task: {DEFAULT_TASK}")